@@ -8,7 +8,7 @@ Features:
 - File upload support (EDF, WFDB .dat, images, PDF - see README for notes)
 - Lead selection and basic image-based lead extraction (simple cropping heuristic)
 - Click-to-annotate on waveform (annotation types)
-- AI-assisted auto-detection (simulated)
+- AI-assisted auto-detection (R-peaks via scipy find_peaks, simulated without scipy)
 - Export annotations as JSON
 - Comments panel and simple quality control flow
 
@@ -20,789 +20,259 @@ Notes:
 
 import streamlit as st
 import numpy as np
-import pandas as pd
 import json
 import io
+import functools
+import hashlib
+import importlib
+import itertools
+import os
+import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from PIL import Image
 import plotly.graph_objects as go
-from streamlit_plotly_events import plotly_events
 
+# Optional imports - handle gracefully if not installed. The file parsers (pyedflib, wfdb) and
+# scipy.signal are imported on first use instead (see `_optional_import`): wfdb and scipy
+# together add most of a second to cold start and the default simulated view needs neither.
+try:
+    import orjson
+except Exception:
+    orjson = None
 
-If you still have questions, leave a message in our forums and we will get back to you ASAP.
-
-[     UTC     ] Logs for ecg-annotator.streamlit.app/
-
-────────────────────────────────────────────────────────────────────────────────────────
-
-[07:18:19] 🚀 Starting up repository: 'ecg-annotator', branch: 'main', main module: 'app.py'
-
-[07:18:19] 🐙 Cloning repository...
-
-[07:18:19] 🐙 Cloning into '/mount/src/ecg-annotator'...
-
-[07:18:19] 🐙 Cloned repository!
-
-[07:18:19] 🐙 Pulling code changes from Github...
-
-[07:18:19] 📦 Processing dependencies...
-
-
-──────────────────────────────────────── uv ───────────────────────────────────────────
-
-
-
-
-Using Python 3.13.8 environment at /home/adminuser/venv
-
-  × No solution found when resolving dependencies:
-
-  ╰─▶ Because only streamlit-plotly-events<=0.0.6 is available and you require
-
-      streamlit-plotly-events>=0.4.2, we can conclude that your requirements
-
-      are unsatisfiable.
-
-Checking if Streamlit is installed
-
-Installing rich for an improved exception logging
-
-Using uv pip install.
-
-Using Python 3.13.8 environment at /home/adminuser/venv
-
-Resolved 4 packages in 127ms
-
-Prepared 4 packages in 99ms
-
-Installed 4 packages in 12ms
-
- + markdown-it-py==4.0.0
-
- + mdurl==0.1.2
-
- + pygments==2.19.2[2025-10-17 07:18:20.547919] 
-
- + rich==14.2.0
-
-
-────────────────────────────────────────────────────────────────────────────────────────
-
-
-
-──────────────────────────────────────── pip ───────────────────────────────────────────
-
-
-Using standard pip install.
-
-Collecting streamlit>=1.20 (from -r /mount/src/ecg-annotator/requirements.txt (line 1))
-
-  Downloading streamlit-1.50.0-py3-none-any.whl.metadata (9.5 kB)
-
-Collecting numpy>=1.21 (from -r /mount/src/ecg-annotator/requirements.txt (line 2))
-
-  Downloading numpy-2.3.4-cp313-cp313-manylinux_2_27_x86_64.manylinux_2_28_x86_64.whl.metadata (62 kB)
-
-     ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 62.1/62.1 kB 4.8 MB/s eta 0:00:00[2025-10-17 07:18:22.255452] 
-
-Collecting pandas>=1.3 (from -r /mount/src/ecg-annotator/requirements.txt (line 3))
-
-  Downloading pandas-2.3.3-cp313-cp313-manylinux_2_24_x86_64.manylinux_2_28_x86_64.whl.metadata (91 kB)
-
-     ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 91.2/91.2 kB 31.5 MB/s eta 0:00:00[2025-10-17 07:18:22.430952] 
-
-Collecting plotly>=5.0 (from -r /mount/src/ecg-annotator/requirements.txt (line 4))
-
-  Downloading plotly-6.3.1-py3-none-any.whl.metadata (8.5 kB)
-
-Collecting Pillow>=8.0 (from -r /mount/src/ecg-annotator/requirements.txt (line 5))
-
-  Downloading pillow-12.0.0-cp313-cp313-manylinux_2_27_x86_64.manylinux_2_28_x86_64.whl.metadata (8.8 kB)
-
-ERROR: Ignored the following versions that require a different python version: 0.55.2 Requires-Python <3.5; 1.21.2 Requires-Python >=3.7,<3.11; 1.21.3 Requires-Python >=3.7,<3.11; 1.21.4 Requires-Python >=3.7,<3.11; 1.21.5 Requires-Python >=3.7,<3.11; 1.21.6 Requires-Python >=3.7,<3.11; 1.26.0 Requires-Python <3.13,>=3.9; 1.26.1 Requires-Python <3.13,>=3.9
-
-ERROR: Could not find a version that satisfies the requirement streamlit-plotly-events>=0.4.2 (from versions: 0.0.5, 0.0.6)
-
-ERROR: No matching distribution found for streamlit-plotly-events>=0.4.2
-
-
-[notice] A new release of pip is available: 24.0 -> 25.2
-
-[notice] To update, run: pip install --upgrade pip
-
-Checking if Streamlit is installed
-
-Installing rich for an improved exception logging
-
-Using standard pip install.
-
-Collecting rich>=10.14.0
-
-  Downloading rich-14.2.0-py3-none-any.whl.metadata (18 kB)
-
-Collecting markdown-it-py>=2.2.0 (from rich>=10.14.0)
-
-  Downloading markdown_it_py-4.0.0-py3-none-any.whl.metadata (7.3 kB)
-
-Collecting pygments<3.0.0,>=2.13.0 (from rich>=10.14.0)
-
-  Downloading pygments-2.19.2-py3-none-any.whl.metadata (2.5 kB)
-
-Collecting mdurl~=0.1 (from markdown-it-py>=2.2.0->rich>=10.14.0)
-
-  Downloading mdurl-0.1.2-py3-none-any.whl.metadata (1.6 kB)
-
-Downloading rich-14.2.0-py3-none-any.whl (243 kB)
-
-   ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 243.4/243.4 kB 11.3 MB/s eta 0:00:00[2025-10-17 07:18:24.078422] 
-
-Downloading markdown_it_py-4.0.0-py3-none-any.whl (87 kB)
-
-   ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 87.3/87.3 kB 202.3 MB/s eta 0:00:00[2025-10-17 07:18:24.091254] 
-
-Downloading pygments-2.19.2-py3-none-any.whl (1.2 MB)
-
-   ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 1.2/1.2 MB 65.6 MB/s eta 0:00:00[2025-10-17 07:18:24.121977] 
-
-Downloading mdurl-0.1.2-py3-none-any.whl (10.0 kB)
-
-Installing collected packages: pygments, mdurl, markdown-it-py, rich
-
-  Attempting uninstall: pygments
-
-    Found existing installation: Pygments 2.19.2
-
-    Uninstalling Pygments-2.19.2:
-
-      Successfully uninstalled Pygments-2.19.2
-
-  Attempting uninstall: mdurl
-
-    Found existing installation: mdurl 0.1.2
-
-    Uninstalling mdurl-0.1.2:
-
-      Successfully uninstalled mdurl-0.1.2
-
-  Attempting uninstall: markdown-it-py
-
-    Found existing installation: markdown-it-py 4.0.0
-
-    Uninstalling markdown-it-py-4.0.0:
-
-      Successfully uninstalled markdown-it-py-4.0.0
-
-  Attempting uninstall: rich
-
-    Found existing installation: rich 14.2.0
-
-    Uninstalling rich-14.2.0:
-
-      Successfully uninstalled rich-14.2.0
-
-Successfully installed markdown-it-py-4.0.0 mdurl-0.1.2 pygments-2.19.2 rich-14.2.0
-
-
-[notice] A new release of pip is available: 24.0 -> 25.2
-
-[notice] To update, run: pip install --upgrade pip
-
-
-────────────────────────────────────────────────────────────────────────────────────────
-
-
-[07:18:25] ❗️ installer returned a non-zero exit code
-
-[07:18:25] ❗️ Error during processing dependencies! Please fix the error and push an update, or try restarting the app.
-
-[07:18:19] 🚀 Starting up repository: 'ecg-annotator', branch: 'main', main module: 'app.py'
-
-[07:18:19] 🐙 Cloning repository...
-
-[07:18:19] 🐙 Cloning into '/mount/src/ecg-annotator'...
-
-[07:18:19] 🐙 Cloned repository!
-
-[07:18:19] 🐙 Pulling code changes from Github...
-
-[07:18:19] 📦 Processing dependencies...
-
-
-──────────────────────────────────────── uv ───────────────────────────────────────────
-
-
-Using uv pip install.
-
-Using Python 3.13.8 environment at /home/adminuser/venv
-
-  × No solution found when resolving dependencies:
-
-  ╰─▶ Because only streamlit-plotly-events<=0.0.6 is available and you require
-
-      streamlit-plotly-events>=0.4.2, we can conclude that your requirements
-
-      are unsatisfiable.
-
-Checking if Streamlit is installed
-
-Installing rich for an improved exception logging
-
-Using uv pip install.
-
-Using Python 3.13.8 environment at /home/adminuser/venv
-
-Resolved 4 packages in 127ms
-
-Prepared 4 packages in 99ms
-
-Installed 4 packages in 12ms
-
- + markdown-it-py==4.0.0
-
- + mdurl==0.1.2
-
- + pygments==2.19.2[2025-10-17 07:18:20.547919] 
-
- + rich==14.2.0
-
-
-────────────────────────────────────────────────────────────────────────────────────────
-
-
-
-──────────────────────────────────────── pip ───────────────────────────────────────────
-
-
-Using standard pip install.
-
-Collecting streamlit>=1.20 (from -r /mount/src/ecg-annotator/requirements.txt (line 1))
-
-  Downloading streamlit-1.50.0-py3-none-any.whl.metadata (9.5 kB)
-
-Collecting numpy>=1.21 (from -r /mount/src/ecg-annotator/requirements.txt (line 2))
-
-  Downloading numpy-2.3.4-cp313-cp313-manylinux_2_27_x86_64.manylinux_2_28_x86_64.whl.metadata (62 kB)
-
-     ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 62.1/62.1 kB 4.8 MB/s eta 0:00:00[2025-10-17 07:18:22.255452] 
-
-Collecting pandas>=1.3 (from -r /mount/src/ecg-annotator/requirements.txt (line 3))
-
-  Downloading pandas-2.3.3-cp313-cp313-manylinux_2_24_x86_64.manylinux_2_28_x86_64.whl.metadata (91 kB)
-
-     ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 91.2/91.2 kB 31.5 MB/s eta 0:00:00[2025-10-17 07:18:22.430952] 
-
-Collecting plotly>=5.0 (from -r /mount/src/ecg-annotator/requirements.txt (line 4))
-
-  Downloading plotly-6.3.1-py3-none-any.whl.metadata (8.5 kB)
-
-Collecting Pillow>=8.0 (from -r /mount/src/ecg-annotator/requirements.txt (line 5))
-
-  Downloading pillow-12.0.0-cp313-cp313-manylinux_2_27_x86_64.manylinux_2_28_x86_64.whl.metadata (8.8 kB)
-
-ERROR: Ignored the following versions that require a different python version: 0.55.2 Requires-Python <3.5; 1.21.2 Requires-Python >=3.7,<3.11; 1.21.3 Requires-Python >=3.7,<3.11; 1.21.4 Requires-Python >=3.7,<3.11; 1.21.5 Requires-Python >=3.7,<3.11; 1.21.6 Requires-Python >=3.7,<3.11; 1.26.0 Requires-Python <3.13,>=3.9; 1.26.1 Requires-Python <3.13,>=3.9
-
-ERROR: Could not find a version that satisfies the requirement streamlit-plotly-events>=0.4.2 (from versions: 0.0.5, 0.0.6)
-
-ERROR: No matching distribution found for streamlit-plotly-events>=0.4.2
-
-
-[notice] A new release of pip is available: 24.0 -> 25.2
-
-[notice] To update, run: pip install --upgrade pip
-
-Checking if Streamlit is installed
-
-Installing rich for an improved exception logging
-
-Using standard pip install.
-
-Collecting rich>=10.14.0
-
-  Downloading rich-14.2.0-py3-none-any.whl.metadata (18 kB)
-
-Collecting markdown-it-py>=2.2.0 (from rich>=10.14.0)
-
-  Downloading markdown_it_py-4.0.0-py3-none-any.whl.metadata (7.3 kB)
-
-Collecting pygments<3.0.0,>=2.13.0 (from rich>=10.14.0)
-
-  Downloading pygments-2.19.2-py3-none-any.whl.metadata (2.5 kB)
-
-Collecting mdurl~=0.1 (from markdown-it-py>=2.2.0->rich>=10.14.0)
-
-  Downloading mdurl-0.1.2-py3-none-any.whl.metadata (1.6 kB)
-
-Downloading rich-14.2.0-py3-none-any.whl (243 kB)
-
-   ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 243.4/243.4 kB 11.3 MB/s eta 0:00:00[2025-10-17 07:18:24.078422] 
-
-Downloading markdown_it_py-4.0.0-py3-none-any.whl (87 kB)
-
-   ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 87.3/87.3 kB 202.3 MB/s eta 0:00:00[2025-10-17 07:18:24.091254] 
-
-Downloading pygments-2.19.2-py3-none-any.whl (1.2 MB)
-
-   ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 1.2/1.2 MB 65.6 MB/s eta 0:00:00[2025-10-17 07:18:24.121977] 
-
-Downloading mdurl-0.1.2-py3-none-any.whl (10.0 kB)
-
-Installing collected packages: pygments, mdurl, markdown-it-py, rich
-
-  Attempting uninstall: pygments
-
-    Found existing installation: Pygments 2.19.2
-
-    Uninstalling Pygments-2.19.2:
-
-      Successfully uninstalled Pygments-2.19.2
-
-  Attempting uninstall: mdurl
-
-    Found existing installation: mdurl 0.1.2
-
-    Uninstalling mdurl-0.1.2:
-
-      Successfully uninstalled mdurl-0.1.2
-
-  Attempting uninstall: markdown-it-py
-
-    Found existing installation: markdown-it-py 4.0.0
-
-    Uninstalling markdown-it-py-4.0.0:
-
-      Successfully uninstalled markdown-it-py-4.0.0
-
-  Attempting uninstall: rich
-
-    Found existing installation: rich 14.2.0
-
-    Uninstalling rich-14.2.0:
-
-      Successfully uninstalled rich-14.2.0
-
-Successfully installed markdown-it-py-4.0.0 mdurl-0.1.2 pygments-2.19.2 rich-14.2.0
-
-
-[notice] A new release of pip is available: 24.0 -> 25.2
-
-[notice] To update, run: pip install --upgrade pip
-
-
-────────────────────────────────────────────────────────────────────────────────────────
-
-
-[07:18:25] ❗️ installer returned a non-zero exit code
-
-[07:18:25] ❗️ Error during processing dependencies! Please fix the error and push an update, or try restarting the app.
-
-[07:25:25] 🐙 Pulling code changes from Github...
-
-[07:25:25] 📦 Processing dependencies...
-
-
-──────────────────────────────────────── uv ───────────────────────────────────────────
-
-
-Using uv pip install.
-
-Using Python 3.13.8 environment at /home/adminuser/venv
-
-  × No solution found when resolving dependencies:
-
-  ╰─▶ Because only streamlit-plotly-events<=0.0.6 is available and you require
-
-      streamlit-plotly-events>=0.4.2, we can conclude that your requirements
-
-      are unsatisfiable.
-
-Checking if Streamlit is installed
-
-Installing rich for an improved exception logging
-
-Using uv pip install.
-
-Using Python 3.13.8 environment at /home/adminuser/venv
-
-Audited 1 package in 1ms
-
-
-────────────────────────────────────────────────────────────────────────────────────────
-
-
-
-──────────────────────────────────────── pip ───────────────────────────────────────────
-
-
-Using standard pip install.
-
-Collecting streamlit>=1.20 (from -r /mount/src/ecg-annotator/requirements.txt (line 1))
-
-  Downloading streamlit-1.50.0-py3-none-any.whl.metadata (9.5 kB)
-
-Collecting numpy>=1.21 (from -r /mount/src/ecg-annotator/requirements.txt (line 2))
-
-  Downloading numpy-2.3.4-cp313-cp313-manylinux_2_27_x86_64.manylinux_2_28_x86_64.whl.metadata (62 kB)
-
-     ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 62.1/62.1 kB 4.1 MB/s eta 0:00:00[2025-10-17 07:25:28.215359] 
-
-Collecting pandas>=1.3 (from -r /mount/src/ecg-annotator/requirements.txt (line 3))
-
-  Downloading pandas-2.3.3-cp313-cp313-manylinux_2_24_x86_64.manylinux_2_28_x86_64.whl.metadata (91 kB)
-
-     ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 91.2/91.2 kB 16.8 MB/s eta 0:00:00[2025-10-17 07:25:28.403591] 
-
-Collecting plotly>=5.0 (from -r /mount/src/ecg-annotator/requirements.txt (line 4))
-
-  Downloading plotly-6.3.1-py3-none-any.whl.metadata (8.5 kB)
-
-Collecting Pillow>=8.0 (from -r /mount/src/ecg-annotator/requirements.txt (line 5))
-
-  Downloading pillow-12.0.0-cp313-cp313-manylinux_2_27_x86_64.manylinux_2_28_x86_64.whl.metadata (8.8 kB)
-
-ERROR: Ignored the following versions that require a different python version: 0.55.2 Requires-Python <3.5; 1.21.2 Requires-Python >=3.7,<3.11; 1.21.3 Requires-Python >=3.7,<3.11; 1.21.4 Requires-Python >=3.7,<3.11; 1.21.5 Requires-Python >=3.7,<3.11; 1.21.6 Requires-Python >=3.7,<3.11; 1.26.0 Requires-Python <3.13,>=3.9; 1.26.1 Requires-Python <3.13,>=3.9
-
-ERROR: Could not find a version that satisfies the requirement streamlit-plotly-events>=0.4.2 (from versions: 0.0.5, 0.0.6)
-
-ERROR: No matching distribution found for streamlit-plotly-events>=0.4.2
-
-
-[notice] A new release of pip is available: 24.0 -> 25.2
-
-[notice] To update, run: pip install --upgrade pip
-
-Checking if Streamlit is installed
-
-Installing rich for an improved exception logging
-
-Using standard pip install.
-
-Collecting rich>=10.14.0
-
-  Downloading rich-14.2.0-py3-none-any.whl.metadata (18 kB)
-
-Collecting markdown-it-py>=2.2.0 (from rich>=10.14.0)
-
-  Downloading markdown_it_py-4.0.0-py3-none-any.whl.metadata (7.3 kB)
-
-Collecting pygments<3.0.0,>=2.13.0 (from rich>=10.14.0)
-
-  Downloading pygments-2.19.2-py3-none-any.whl.metadata (2.5 kB)
-
-Collecting mdurl~=0.1 (from markdown-it-py>=2.2.0->rich>=10.14.0)
-
-  Downloading mdurl-0.1.2-py3-none-any.whl.metadata (1.6 kB)
-
-Downloading rich-14.2.0-py3-none-any.whl (243 kB)
-
-   ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 243.4/243.4 kB 14.2 MB/s eta 0:00:00[2025-10-17 07:25:29.959211] 
-
-Downloading markdown_it_py-4.0.0-py3-none-any.whl (87 kB)
-
-   ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 87.3/87.3 kB 178.8 MB/s eta 0:00:00[2025-10-17 07:25:29.971232] 
-
-Downloading pygments-2.19.2-py3-none-any.whl (1.2 MB)
-
-   ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 1.2/1.2 MB 78.6 MB/s eta 0:00:00[2025-10-17 07:25:29.999952] 
-
-Downloading mdurl-0.1.2-py3-none-any.whl (10.0 kB)
-
-Installing collected packages: pygments, mdurl, markdown-it-py, rich
-
-  Attempting uninstall: pygments
-
-    Found existing installation: Pygments 2.19.2
-
-    Uninstalling Pygments-2.19.2:
-
-      Successfully uninstalled Pygments-2.19.2
-
-  Attempting uninstall: mdurl
-
-    Found existing installation: mdurl 0.1.2
-
-    Uninstalling mdurl-0.1.2:
-
-      Successfully uninstalled mdurl-0.1.2
-
-  Attempting uninstall: markdown-it-py
-
-    Found existing installation: markdown-it-py 4.0.0
-
-    Uninstalling markdown-it-py-4.0.0:
-
-      Successfully uninstalled markdown-it-py-4.0.0
-
-  Attempting uninstall: rich
-
-    Found existing installation: rich 14.2.0
-
-    Uninstalling rich-14.2.0:
-
-      Successfully uninstalled rich-14.2.0
-
-Successfully installed markdown-it-py-4.0.0 mdurl-0.1.2 pygments-2.19.2 rich-14.2.0
-
-
-[notice] A new release of pip is available: 24.0 -> 25.2
-
-[notice] To update, run: pip install --upgrade pip
-
-
-────────────────────────────────────────────────────────────────────────────────────────
-
-
-[07:25:31] ❗️ installer returned a non-zero exit code
-
-[07:25:43] 🖥 Provisioning machine...
-
-[07:25:48] 🎛 Preparing system...
-
-[07:25:47] 🚀 Starting up repository: 'ecg-annotator', branch: 'main', main module: 'app.py'
-
-[07:25:47] 🐙 Cloning repository...
-
-[07:25:47] 🐙 Cloning into '/mount/src/ecg-annotator'...
-
-[07:25:47] 🐙 Cloned repository!
-
-[07:25:47] 🐙 Pulling code changes from Github...
-
-[07:25:47] 📦 Processing dependencies...
-
-
-──────────────────────────────────────── uv ───────────────────────────────────────────
-
-
-Using uv pip install.
-
-Using Python 3.13.8 environment at /home/adminuser/venv
-
-  × No solution found when resolving dependencies:[2025-10-17 07:25:48.531677] 
-
-  ╰─▶ Because only streamlit-plotly-events<=0.0.6 is available and you require
-
-      streamlit-plotly-events>=0.4.2, we can conclude that your requirements
-
-      are unsatisfiable.[2025-10-17 07:25:48.532753] 
-
-Checking if Streamlit is installed
-
-Installing rich for an improved exception logging
-
-Using uv pip install.
-
-Using Python 3.13.8 environment at /home/adminuser/venv
-
-Resolved 4 packages in 150ms
-
-Prepared 4 packages in 135ms
-
-Installed 4 packages in 14ms
-
- + markdown-it-py==4.0.0
-
- + mdurl==0.1.2[2025-10-17 07:25:48.853553] 
-
- + pygments==2.19.2
-
- + rich==14.2.0
-
-
-────────────────────────────────────────────────────────────────────────────────────────
-
-
-
-──────────────────────────────────────── pip ───────────────────────────────────────────
-
-
-Using standard pip install.
-
-[07:25:49] ⛓ Spinning up manager process...
-
-Collecting streamlit>=1.20 (from -r /mount/src/ecg-annotator/requirements.txt (line 1))
-
-  Downloading streamlit-1.50.0-py3-none-any.whl.metadata (9.5 kB)
-
-Collecting numpy>=1.21 (from -r /mount/src/ecg-annotator/requirements.txt (line 2))
-
-  Downloading numpy-2.3.4-cp313-cp313-manylinux_2_27_x86_64.manylinux_2_28_x86_64.whl.metadata (62 kB)
-
-     ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 62.1/62.1 kB 4.5 MB/s eta 0:00:00[2025-10-17 07:25:50.571269] 
-
-Collecting pandas>=1.3 (from -r /mount/src/ecg-annotator/requirements.txt (line 3))
-
-  Downloading pandas-2.3.3-cp313-cp313-manylinux_2_24_x86_64.manylinux_2_28_x86_64.whl.metadata (91 kB)
-
-     ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 91.2/91.2 kB 48.5 MB/s eta 0:00:00[2025-10-17 07:25:50.768199] 
-
-Collecting plotly>=5.0 (from -r /mount/src/ecg-annotator/requirements.txt (line 4))
-
-  Downloading plotly-6.3.1-py3-none-any.whl.metadata (8.5 kB)
+# --- Helpers and Defaults ---
 
-Collecting Pillow>=8.0 (from -r /mount/src/ecg-annotator/requirements.txt (line 5))
+SAMPLE_RATE_DEFAULT = 500  # Hz
+DURATION_DEFAULT = 10      # seconds
+ZOOM_MIN, ZOOM_MAX = 0.5, 4.0
+MAX_VISIBLE_DURATION = DURATION_DEFAULT / ZOOM_MIN  # seconds shown at the widest zoom
+PLOT_MAX_POINTS = 2000     # max points sent to the browser for the waveform trace
+REVIEW_DELAY = 1.0         # seconds; simulated time until a submitted review is approved
+DETECTION_POLL = 0.5       # seconds between checks on a background Auto-Detect job
+LEAD_IMAGE_MAX_PX = 2048   # uploaded ECG images are decoded at most this large per side
+COMMENTS_SHOWN = 50        # most recent comments rendered under the viewer
+MARKER_LABELS_MAX = 20     # more visible annotations than this: marker labels only on hover
+DUPLICATE_TOLERANCE = 0.05  # seconds; AI peaks this close to an existing R-Peak are dropped
+BANDPASS_HZ = (0.5, 40.0)  # ingest filter: removes baseline wander and mains/EMG noise
 
-  Downloading pillow-12.0.0-cp313-cp313-manylinux_2_27_x86_64.manylinux_2_28_x86_64.whl.metadata (8.8 kB)
+LEADS = ['Lead I', 'Lead II', 'Lead III', 'aVR', 'aVL', 'aVF',
+         'V1', 'V2', 'V3', 'V4', 'V5', 'V6']
 
-ERROR: Ignored the following versions that require a different python version: 0.55.2 Requires-Python <3.5; 1.21.2 Requires-Python >=3.7,<3.11; 1.21.3 Requires-Python >=3.7,<3.11; 1.21.4 Requires-Python >=3.7,<3.11; 1.21.5 Requires-Python >=3.7,<3.11; 1.21.6 Requires-Python >=3.7,<3.11; 1.26.0 Requires-Python <3.13,>=3.9; 1.26.1 Requires-Python <3.13,>=3.9
+ANNOTATION_TYPES = [
+    {"name": "R-Peak", "color": "#ef4444", "symbol": "R"},
+    {"name": "P-Wave", "color": "#3b82f6", "symbol": "P"},
+    {"name": "PR-Segment", "color": "#a78bfa", "symbol": "PR"},
+    {"name": "T-Wave", "color": "#10b981", "symbol": "T"},
+    {"name": "QRS-Start", "color": "#f59e0b", "symbol": "Q"},
+    {"name": "QRS-End", "color": "#8b5cf6", "symbol": "S"},
+    {"name": "J-Point", "color": "#f97316", "symbol": "J"},
+    {"name": "ST-Segment", "color": "#06b6d4", "symbol": "ST"},
+    {"name": "Arrhythmia", "color": "#ec4899", "symbol": "A"},
+]
+ANNOTATION_NAMES = [a["name"] for a in ANNOTATION_TYPES]
+ANNOTATION_SYMBOLS = {a["name"]: a["symbol"] for a in ANNOTATION_TYPES}
+# type code (index into ANNOTATION_TYPES) -> colour, for vectorized lookup from the annotation index
+ANNOTATION_CODES = {a["name"]: np.uint8(i) for i, a in enumerate(ANNOTATION_TYPES)}
+ANNOTATION_COLOR_BY_CODE = np.array([a["color"] for a in ANNOTATION_TYPES])
+ANNOTATION_NAME_BY_CODE = np.array(ANNOTATION_NAMES)
+# (aiGenerated, colour, dash) for the annotation line traces
+ANNOTATION_LINE_STYLES = ((False, "#FF9900", "dash"), (True, "#a855f7", "dot"))
 
-ERROR: Could not find a version that satisfies the requirement streamlit-plotly-events>=0.4.2 (from versions: 0.0.5, 0.0.6)
+# static part of the export "metadata" block; per-export fields are merged in at click time
+EXPORT_METADATA = {"annotator": "Streamlit User"}
 
-ERROR: No matching distribution found for streamlit-plotly-events>=0.4.2
 
+def buffer_digest(b: bytes) -> str:
+    """Content key for uploaded buffers (SHA-1 is hardware-accelerated; faster than blake2b here)."""
+    return hashlib.sha1(b).hexdigest()
 
-[notice] A new release of pip is available: 24.0 -> 25.2
 
-[notice] To update, run: pip install --upgrade pip
+def _optional_import(name: str):
+    """Import an optional dependency on first use; None if it isn't installed."""
+    try:
+        return importlib.import_module(name)
+    except Exception:
+        return None
 
-Checking if Streamlit is installed
 
-Installing rich for an improved exception logging
+# Uploaded buffers can be large; hash them with a digest instead of Streamlit's default
+_BYTES_HASH_FUNCS = {bytes: buffer_digest}
 
-Using standard pip install.
 
-Collecting rich>=10.14.0
+def make_signal(values, fs, t0=0.0, record_duration=None):
+    """
+    In-memory signal representation: float32 amplitudes ("v"), the sample rate ("fs") and the
+    time of the first sample ("t0"). Samples are uniform, so time is derived on demand with
+    `signal_time` / `sample_index` instead of being stored as a second N-sized array.
+    Parsers that load a window of a longer record pass the full length as `record_duration`
+    (seconds); it defaults to the end of the loaded samples.
+    """
+    v = np.asarray(values, dtype=np.float32)
+    if record_duration is None:
+        record_duration = t0 + len(v) / fs
+    return {"v": v, "fs": fs, "t0": float(t0), "record_duration": float(record_duration)}
 
-  Downloading rich-14.2.0-py3-none-any.whl.metadata (18 kB)
 
-Collecting markdown-it-py>=2.2.0 (from rich>=10.14.0)
+def signal_summary(sig: dict) -> str:
+    """Sidebar description of which part of the record is loaded."""
+    loaded = len(sig["v"]) / sig["fs"]
+    if loaded >= sig["record_duration"]:
+        return f"Samples: {len(sig['v'])}"
+    return (f"Showing {loaded:.1f} s from {sig['t0']:.1f} s of a {sig['record_duration']:.1f} s record "
+            f"(samples: {len(sig['v'])}).")
 
-  Downloading markdown_it_py-4.0.0-py3-none-any.whl.metadata (7.3 kB)
 
-Collecting pygments<3.0.0,>=2.13.0 (from rich>=10.14.0)
+def signal_time(sig: dict) -> np.ndarray:
+    """
+    Time axis (seconds) for a signal dict. float64: deep into a long record float32 can no
+    longer tell neighbouring samples apart (its spacing passes 2 ms above t0 = 32768 s).
+    """
+    return sig["t0"] + np.arange(len(sig["v"])) / sig["fs"]
 
-  Downloading pygments-2.19.2-py3-none-any.whl.metadata (2.5 kB)
 
-Collecting mdurl~=0.1 (from markdown-it-py>=2.2.0->rich>=10.14.0)
+def sample_index(sig: dict, times) -> np.ndarray:
+    """Index of the sample nearest to each time, clipped to the signal."""
+    idx = np.rint((np.asarray(times, dtype=np.float64) - sig["t0"]) * sig["fs"]).astype(np.int64)
+    return np.clip(idx, 0, len(sig["v"]) - 1)
 
-  Downloading mdurl-0.1.2-py3-none-any.whl.metadata (1.6 kB)
 
-Downloading rich-14.2.0-py3-none-any.whl (243 kB)
+@functools.lru_cache(maxsize=8)
+def _bandpass_sos(fs: float):
+    """4th-order Butterworth BANDPASS_HZ design for a sample rate, or None without scipy."""
+    scipy_signal = _optional_import("scipy.signal")
+    if scipy_signal is None:
+        return None
+    low, high = BANDPASS_HZ
+    # keep the upper edge below Nyquist for low sample rates
+    return scipy_signal.butter(4, [low, min(high, 0.45 * fs)], btype="band", fs=fs, output="sos")
 
-   ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━ 243.4/243.4 kB 14.4 MB/s eta 0:00:00[2025-10-17 07:25:52.567977] 
 
-Downloading markdown_it_py-4.0.0-py3-
-# Optional imports - handle gracefully if not installed
-try:
-    import pyedflib
-except Exception:
-    pyedflib = None
+def bandpass_filter(values: np.ndarray, fs: float) -> np.ndarray:
+    """Zero-phase BANDPASS_HZ filter for ingested signals; returns `values` unchanged without scipy."""
+    sos = _bandpass_sos(float(fs))
+    # sosfiltfilt pads 3 * (2 * sections + 1) samples at each end; skip windows shorter than that
+    if sos is None or len(values) <= 3 * (2 * len(sos) + 1):
+        return values
+    return _optional_import("scipy.signal").sosfiltfilt(sos, values)
 
-try:
-    import wfdb
-except Exception:
-    wfdb = None
 
-# --- Helpers and Defaults ---
+@st.cache_data(max_entries=16, show_spinner=False)
+def generate_ecg_data(duration=DURATION_DEFAULT, sample_rate=SAMPLE_RATE_DEFAULT, seed=0):
+    """Generate a simple synthetic ECG-like waveform as a signal dict (see `make_signal`).
 
-SAMPLE_RATE_DEFAULT = 500  # Hz
-DURATION_DEFAULT = 10      # seconds
+    Cached on (duration, sample_rate, seed); keep the seed fixed so reruns hit the cache.
+    """
+    # Local generator: no global RNG state to reseed (or leak into other callers)
+    rng = np.random.default_rng(seed)
+    samples = int(duration * sample_rate)
+    # Work in float32 throughout: half the bytes of float64 for every array op below
+    t = np.linspace(0, duration, samples, endpoint=False, dtype=np.float32)
+    values = np.zeros_like(t)
 
-LEADS = ['Lead I', 'Lead II', 'Lead III', 'aVR', 'aVL', 'aVF',
-         'V1', 'V2', 'V3', 'V4', 'V5', 'V6']
+    beat_interval = 0.8
+    # Build waveform from simple components, vectorized over all samples
+    phase = np.mod(t, beat_interval) / beat_interval
 
-ANNOTATION_TYPES = [
-    {"name": "R-Peak", "color": "#ef4444", "symbol": "R"},
-    {"name": "P-Wave", "color": "#3b82f6", "symbol": "P"},
-    {"name": "PR-Segment", "color": "#a78bfa", "symbol": "PR"},
-    {"name": "T-Wave", "color": "#10b981", "symbol": "T"},
-    {"name": "QRS-Start", "color": "#f59e0b", "symbol": "Q"},
-    {"name": "QRS-End", "color": "#8b5cf6", "symbol": "S"},
-    {"name": "J-Point", "color": "#f97316", "symbol": "J"},
-    {"name": "ST-Segment", "color": "#06b6d4", "symbol": "ST"},
-    {"name": "Arrhythmia", "color": "#ec4899", "symbol": "A"},
-]
+    # P-wave
+    m = (phase > 0.1) & (phase < 0.2)
+    values[m] += 0.15 * np.sin((phase[m] - 0.1) * np.pi * 10)
 
+    # QRS complex (piecewise constant Q / R / S deflections)
+    m = (phase > 0.25) & (phase < 0.35)
+    qrs_phase = (phase[m] - 0.25) * 20
+    values[m] += np.select([qrs_phase < 0.3, qrs_phase < 0.7], [-0.3, 1.5], default=-0.4)
 
-def generate_ecg_data(duration=DURATION_DEFAULT, sample_rate=SAMPLE_RATE_DEFAULT, seed=None):
-    """Generate a simple synthetic ECG-like waveform as time,value pairs."""
-    if seed is not None:
-        np.random.seed(seed)
-    samples = int(duration * sample_rate)
-    t = np.linspace(0, duration, samples, endpoint=False)
-    values = np.zeros_like(t)
+    # T-wave
+    m = (phase > 0.45) & (phase < 0.65)
+    values[m] += 0.3 * np.sin((phase[m] - 0.45) * np.pi * 5)
 
-    beat_interval = 0.8
-    # Build waveform using simple components
-    for i, ti in enumerate(t):
-        phase = (ti % beat_interval) / beat_interval
-        v = 0.0
-        if 0.1 < phase < 0.2:
-            v += 0.15 * np.sin((phase - 0.1) * np.pi * 10)
-        if 0.25 < phase < 0.35:
-            qrs_phase = (phase - 0.25) * 20
-            if qrs_phase < 0.3:
-                v -= 0.3
-            elif qrs_phase < 0.7:
-                v += 1.5
-            else:
-                v -= 0.4
-        if 0.45 < phase < 0.65:
-            v += 0.3 * np.sin((phase - 0.45) * np.pi * 5)
-        v += (np.random.rand() - 0.5) * 0.05
-        values[i] = v
-    df = pd.DataFrame({"time": t, "value": values})
-    return df
+    values += (rng.random(samples, dtype=np.float32) - 0.5) * 0.05
+    return make_signal(values, sample_rate)
 
 
-def parse_edf_file(buffer: bytes):
-    """Basic EDF parsing using pyedflib if available. Returns a DataFrame for first signal."""
+@st.cache_data(max_entries=8, show_spinner=False, hash_funcs=_BYTES_HASH_FUNCS)
+def parse_edf_file(buffer: bytes, start_sec: float = 0.0, duration_sec: float = MAX_VISIBLE_DURATION):
+    """
+    Basic EDF parsing using pyedflib if available. Returns a signal dict for the first signal,
+    reading only the [start_sec, start_sec + duration_sec) window rather than the whole record,
+    or None if the record can't be read.
+    """
+    pyedflib = _optional_import("pyedflib")
     if pyedflib is None:
-        st.warning("pyEDFlib not installed - returning simulated data. Install with `pip install pyedflib`.")
-        return generate_ecg_data()
+        st.warning("pyEDFlib not installed - showing simulated data. Install with `pip install pyedflib`.")
+        return None
     try:
-        with io.BytesIO(buffer) as bio:
-            # pyedflib needs a filename-like object on filesystem; write to temp file
-            import tempfile
-            with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        # pyedflib needs a file on disk; the directory (and file) is removed once the window is read
+        with tempfile.TemporaryDirectory() as d:
+            fname = os.path.join(d, "record.edf")
+            with open(fname, "wb") as tmp:
                 tmp.write(buffer)
-                tmp.flush()
-                fname = tmp.name
             f = pyedflib.EdfReader(fname)
-            n = f.signals_in_file
-            sigbufs = f.readSignal(0)
-            fs = int(f.getSampleFrequency(0))
-            f._close()
-            # Build dataframe
-            t = np.arange(len(sigbufs)) / fs
-            values = np.asarray(sigbufs)
-            df = pd.DataFrame({"time": t, "value": values})
-            return df
+            try:
+                fs = int(f.getSampleFrequency(0))
+                total = int(f.getNSamples()[0])
+                start = min(int(start_sec * fs), total)
+                n = min(int(duration_sec * fs), total - start)
+                sigbufs = f.readSignal(0, start=start, n=n)
+            finally:
+                f._close()
+        return make_signal(bandpass_filter(sigbufs, fs), fs, t0=start / fs, record_duration=total / fs)
     except Exception as e:
         st.error(f"Error parsing EDF: {e}")
-        return generate_ecg_data()
+        return None
 
 
-def parse_wfdb_dat(buffer: bytes):
-    """Try to parse WFDB .dat using wfdb package if available. Returns DataFrame or simulated data."""
+@st.cache_data(max_entries=8, show_spinner=False, hash_funcs=_BYTES_HASH_FUNCS)
+def parse_wfdb_dat(buffer: bytes, header_buffer: bytes, start_sec: float = 0.0,
+                   duration_sec: float = MAX_VISIBLE_DURATION):
+    """
+    Parse a WFDB record (.dat plus its .hea header) using the wfdb package if available.
+    Returns a signal dict, or None if the record can't be read.
+    Only channel 0 and the [start_sec, start_sec + duration_sec) sample range are decoded.
+    """
+    wfdb = _optional_import("wfdb")
     if wfdb is None:
-        st.warning("wfdb package not installed - returning simulated data. Install with `pip install wfdb`.")
-        return generate_ecg_data()
+        st.warning("wfdb package not installed - showing simulated data. Install with `pip install wfdb`.")
+        return None
+    if not header_buffer:
+        st.error("WFDB records need their .hea header - upload it together with the .dat file.")
+        return None
     try:
-        import tempfile
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            tmp.write(buffer)
-            tmp.flush()
-            fname = tmp.name
-        # wfdb.rdsamp expects a recordname (without .dat) + path; this is a best-effort approach:
-        # Use wfdb.rdrecord for raw files - but this simplistic approach may not work for all wfdb dat formats.
-        record = wfdb.rdrecord(fname.replace('.dat', ''), physical=False, pn_dir=None)
+        # wfdb.rdrecord expects a record name (without extension) + path. The header names the
+        # signal file it describes, so the .dat is written under that name next to it. The temp
+        # directory is removed after the read; the parsed window itself is cached by st.cache_data.
+        with tempfile.TemporaryDirectory() as d:
+            record_name = os.path.join(d, "record")
+            with open(record_name + ".hea", "wb") as tmp:
+                tmp.write(header_buffer)
+            header = wfdb.rdheader(record_name)
+            with open(os.path.join(d, os.path.basename(header.file_name[0])), "wb") as tmp:
+                tmp.write(buffer)
+            fs = header.fs or 360
+            sampfrom = min(int(start_sec * fs), header.sig_len)
+            sampto = min(sampfrom + int(duration_sec * fs), header.sig_len)
+            record = wfdb.rdrecord(record_name, channels=[0], sampfrom=sampfrom, sampto=sampto,
+                                   physical=True, return_res=32)
         sig = record.p_signal[:, 0]
-        fs = record.fs if hasattr(record, "fs") else 360
-        t = np.arange(len(sig)) / fs
-        df = pd.DataFrame({"time": t, "value": sig})
-        return df
+        return make_signal(bandpass_filter(sig, fs), fs, t0=sampfrom / fs,
+                           record_duration=header.sig_len / fs)
     except Exception as e:
         st.error(f"Error parsing WFDB data: {e}")
-        return generate_ecg_data()
+        return None
 
 
-def extract_leads_from_image_pil(image: Image.Image):
+@st.cache_data(max_entries=4, show_spinner=False, hash_funcs=_BYTES_HASH_FUNCS)
+def extract_leads_from_image_pil(img_bytes: bytes):
     """
     Very simple heuristic extraction: split image into a 4x4 grid and map common 12-lead positions.
     This is a naive approach and will work only for standard 12-lead layouts with consistent margins.
+    Returns {lead: crop box}; pixels are only encoded when a lead is shown (see `encode_lead_png`).
+    Cached on the raw upload bytes, which are cheap to hash compared to a decoded image.
     """
-    w, h = image.size
+    # Image.open only parses the header here; the size is all the grid needs
+    w, h = Image.open(io.BytesIO(img_bytes)).size
     lead_h = h // 4
     lead_w = w // 4
     positions = {
@@ -819,43 +289,328 @@ def extract_leads_from_image_pil(image: Image.Image):
         'V5': (lead_w * 2, lead_h * 2, lead_w * 3, lead_h * 3),
         'V6': (lead_w * 3, lead_h * 2, lead_w * 4, lead_h * 3),
     }
-    extracted = {}
-    for lead, (x1, y1, x2, y2) in positions.items():
-        crop = image.crop((x1, y1, x2, y2))
-        buf = io.BytesIO()
-        crop.save(buf, format="PNG")
-        extracted[lead] = buf.getvalue()
-    return extracted
-
-
-def run_ai_detection_simulation(df: pd.DataFrame, selected_lead: str, existing_annotations: list):
-    """Simulate AI detection of R-peaks every ~beat interval. Returns list of annotations (dicts)."""
-    # Find peaks by thresholding the value (naive)
-    annotations = []
-    beat_interval = 0.8
-    times = np.arange(0, DURATION_DEFAULT, beat_interval)
-    base_id = int(time.time() * 1000)
-    for i, t0 in enumerate(times):
-        # place an R-peak near the expected time (offset)
-        ann_time = float(np.clip(t0 + 0.28, 0, df['time'].iloc[-1]))
-        annotations.append({
-            "id": base_id + i,
-            "time": ann_time,
+    return positions
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _decoded_image(digest: str, _img_bytes: bytes):
+    """
+    Decode an upload to an RGB array once per content digest, bounded to LEAD_IMAGE_MAX_PX per
+    side; lead crops are views into it. Returns (array, scale from original to array pixels).
+    """
+    img = Image.open(io.BytesIO(_img_bytes))
+    orig_w, orig_h = img.size
+    ratio = min(1.0, LEAD_IMAGE_MAX_PX / max(orig_w, orig_h))
+    # JPEG only: let the decoder downscale by a DCT factor (to no less than the bounded size)
+    # instead of decoding full resolution; thumbnail() then trims to the exact bound
+    img.draft("RGB", (int(orig_w * ratio), int(orig_h * ratio)))
+    img = img.convert("RGB")
+    img.thumbnail((LEAD_IMAGE_MAX_PX, LEAD_IMAGE_MAX_PX), Image.Resampling.BILINEAR)
+    return np.asarray(img), img.size[0] / orig_w
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def encode_lead_png(digest: str, box: tuple, _img_bytes: bytes):
+    """
+    PNG-encode a single lead region on demand. Deflate level 1: these are previews, not archives.
+    Keyed on the upload's stored digest, so reruns don't re-hash the image bytes.
+    """
+    arr, scale = _decoded_image(digest, _img_bytes)
+    # boxes are in original-image pixels; map them onto the (possibly downscaled) array
+    x0, y0, x1, y1 = (round(c * scale) for c in box)
+    crop = arr[y0:y1, x0:x1]
+    buf = io.BytesIO()
+    Image.fromarray(crop).save(buf, format="PNG", optimize=False, compress_level=1)
+    return buf.getvalue()
+
+
+def run_ai_detection_simulation(sig: dict, selected_lead: str, existing_t: np.ndarray, rng: np.random.Generator):
+    """
+    Detect R-peaks with scipy's find_peaks when available, else simulate one every ~beat interval.
+    Returns list of new annotations (dicts); peaks within DUPLICATE_TOLERANCE of a time in the
+    sorted `existing_t` (current R-Peak annotations) are skipped.
+    """
+    scipy_signal = _optional_import("scipy.signal")
+    if scipy_signal is not None:
+        # refractory distance of 0.4 s (150 bpm max) and a prominence well above P/T waves
+        peaks, _ = scipy_signal.find_peaks(sig["v"], distance=max(1, int(0.4 * sig["fs"])), prominence=0.5)
+        ann_times = sig["t0"] + peaks / sig["fs"]
+    else:
+        beat_interval = 0.8
+        # span the loaded record, whatever its length, rather than the default duration
+        t_start, t_end = sig["t0"], sig["t0"] + (len(sig["v"]) - 1) / sig["fs"]
+        times = np.arange(t_start, t_end, beat_interval)
+        # place an R-peak near the expected time (offset) of every beat
+        ann_times = np.clip(times + 0.28, t_start, t_end)
+
+    # Merge with existing, avoid duplicates: binary-search each candidate against sorted existing peaks
+    if existing_t.size:
+        right = np.clip(np.searchsorted(existing_t, ann_times), 0, len(existing_t) - 1)
+        left = np.clip(right - 1, 0, len(existing_t) - 1)
+        dist = np.minimum(np.abs(existing_t[right] - ann_times), np.abs(existing_t[left] - ann_times))
+        ann_times = ann_times[dist > DUPLICATE_TOLERANCE]
+
+    confidences = np.round(rng.uniform(0.9, 1.0, size=len(ann_times)), 3)
+    return [
+        {
+            "time": t,
             "type": "R-Peak",
             "lead": selected_lead,
             "aiGenerated": True,
-            "confidence": round(0.9 + 0.1 * np.random.rand(), 3)
-        })
-    # Merge with existing, avoid duplicates
-    return annotations
+            "confidence": conf
+        } for t, conf in zip(ann_times.tolist(), confidences.tolist())
+    ]
+
+
+
+def lttb_downsample(x: np.ndarray, y: np.ndarray, n_out: int = PLOT_MAX_POINTS):
+    """
+    Largest-Triangle-Three-Buckets downsampling for display, vectorized over buckets.
+    Each bucket keeps the point forming the largest triangle with the means of its
+    neighbouring buckets (instead of the previously selected point, which would force
+    a sequential loop). First and last samples are always kept.
+    """
+    n = len(x)
+    if n_out < 3 or n <= n_out:
+        return x, y
+    # n_out - 2 interior buckets spanning samples [1, n - 1)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts = edges[:-1]
+    counts = np.diff(edges)
+    # divide by counts in the input dtype so float32 signals stay float32
+    fcounts = counts.astype(np.result_type(x.dtype, y.dtype, np.float32))
+    mean_x = np.add.reduceat(x[:n - 1], starts) / fcounts
+    mean_y = np.add.reduceat(y[:n - 1], starts) / fcounts
+    ax = np.concatenate(([x[0]], mean_x[:-1]))
+    ay = np.concatenate(([y[0]], mean_y[:-1]))
+    cx = np.concatenate((mean_x[1:], [x[-1]]))
+    cy = np.concatenate((mean_y[1:], [y[-1]]))
+
+    bucket = np.repeat(np.arange(len(counts)), counts)
+    bx, by = x[1:n - 1], y[1:n - 1]
+    area = np.abs((ax[bucket] - cx[bucket]) * (by - ay[bucket])
+                  - (ax[bucket] - bx) * (cy[bucket] - ay[bucket]))
+    best = np.maximum.reduceat(area, starts - 1)
+    # first index reaching the bucket maximum
+    hits = np.flatnonzero(area == best[bucket])
+    hit_bucket = bucket[hits]
+    first = hits[np.concatenate(([True], hit_bucket[1:] != hit_bucket[:-1]))]
+    idx = np.concatenate(([0], first + 1, [n - 1]))
+    return x[idx], y[idx]
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def build_base_figure(ecg_key: str, x_min: float, x_max: float, show_grid: bool, _sig: dict):
+    """
+    Waveform-only figure (LTTB-downsampled trace + layout/template), cached across reruns.
+    Keyed on the signal's `ecg_key` digest (see `set_ecg_signal`) rather than on the arrays,
+    so a cache hit costs no hashing. Callers add annotation overlays to a copy.
+    The whole loaded signal stays in the trace so panning never runs into blank space; the
+    point budget scales with zoom so the visible [x_min, x_max] span keeps about
+    PLOT_MAX_POINTS points (capped by the sample count).
+    """
+    t = signal_time(_sig)
+    span = t[-1] - t[0] if len(t) > 1 else 0.0
+    n_out = int(PLOT_MAX_POINTS * max(1.0, span / (x_max - x_min)))
+    t, v = lttb_downsample(t, _sig["v"], n_out)
+    fig = go.Figure()
+    fig.add_trace(go.Scattergl(
+        x=t,
+        y=v,
+        mode='lines',
+        line=dict(color='#22c55e'),
+        name='ECG'
+    ))
+    fig.update_layout(
+        margin=dict(l=40, r=20, t=20, b=40),
+        template="plotly_dark",
+        xaxis=dict(range=[x_min, x_max], title="Time (s)", showgrid=show_grid),
+        yaxis=dict(title="Amplitude (mV)", showgrid=show_grid),
+        height=450
+    )
+    return fig
+
+
+def vline_trace(times, y0, y1, color, dash):
+    """Vertical lines at `times` as a single Scattergl trace of NaN-separated segments."""
+    n = len(times)
+    xs = np.empty(3 * n)
+    xs[0::3] = times
+    xs[1::3] = times
+    xs[2::3] = np.nan
+    ys = np.tile([y0, y1, np.nan], n)
+    return go.Scattergl(
+        x=xs,
+        y=ys,
+        mode='lines',
+        line=dict(color=color, width=2, dash=dash),
+        hoverinfo='skip',
+        showlegend=False
+    )
+
+
+def dumps_json(obj) -> bytes:
+    """Compact JSON bytes; uses orjson (C encoder) when installed, stdlib json otherwise."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def set_ecg_signal(sig: dict):
+    """
+    Make `sig` the active signal. Per-signal values the viewer needs on every rerun (content
+    digest, annotation line extent) are computed here once instead of per rerun.
+    """
+    v = sig["v"]
+    st.session_state.ecg_sig = sig
+    st.session_state.ecg_key = f"{buffer_digest(v.tobytes())}:{sig['fs']}:{sig['t0']}"
+    st.session_state.ann_line_y = (float(v.min()) - 0.5, float(v.max()) + 0.5)
+
+
+def next_id() -> int:
+    """Next value of the per-session id counter (annotations and comments); stable widget keys."""
+    st.session_state._id_counter += 1
+    return st.session_state._id_counter
+
+
+def add_annotations(anns):
+    """
+    Insert annotations into the id map and the time-sorted (_ann_times, _ann_ids, _ann_types,
+    _ann_ai, _ann_conf) index. Ids are always assigned here from `next_id`.
+    """
+    ss = st.session_state
+    # validate the whole batch before touching state, so a bad entry can't leave the id map
+    # and the index out of step
+    for a in anns:
+        if "id" in a:
+            raise ValueError(f"annotation already has id {a['id']}; ids are assigned by add_annotations")
+    new_t = np.array([a["time"] for a in anns], dtype=np.float64)
+    new_types = np.array([ANNOTATION_CODES[a["type"]] for a in anns], dtype=np.uint8)
+    new_ai = np.array([bool(a.get("aiGenerated")) for a in anns], dtype=bool)
+    new_conf = np.array([a.get("confidence", 0.0) for a in anns], dtype=np.float64)
+    for a in anns:
+        a["id"] = next_id()
+        ss.annotations[a["id"]] = a
+    new_ids = np.array([a["id"] for a in anns], dtype=np.int64)
+    # sort the batch first so inserts at equal positions keep the index ordered
+    order = np.argsort(new_t, kind="stable")
+    new_t, new_ids, new_types = new_t[order], new_ids[order], new_types[order]
+    new_ai, new_conf = new_ai[order], new_conf[order]
+    pos = np.searchsorted(ss._ann_times, new_t, side="right")
+    ss._ann_times = np.insert(ss._ann_times, pos, new_t)
+    ss._ann_ids = np.insert(ss._ann_ids, pos, new_ids)
+    ss._ann_types = np.insert(ss._ann_types, pos, new_types)
+    ss._ann_ai = np.insert(ss._ann_ai, pos, new_ai)
+    ss._ann_conf = np.insert(ss._ann_conf, pos, new_conf)
+
+
+def remove_annotation(ann_id):
+    """Remove an annotation (also the Remove button callback, so the row is gone without a second rerun)."""
+    ss = st.session_state
+    ann = ss.annotations.pop(ann_id, None)
+    if ann is None:
+        return
+    lo = np.searchsorted(ss._ann_times, ann["time"], side="left")
+    hi = np.searchsorted(ss._ann_times, ann["time"], side="right")
+    i = lo + int(np.flatnonzero(ss._ann_ids[lo:hi] == ann_id)[0])
+    ss._ann_times = np.delete(ss._ann_times, i)
+    ss._ann_ids = np.delete(ss._ann_ids, i)
+    ss._ann_types = np.delete(ss._ann_types, i)
+    ss._ann_ai = np.delete(ss._ann_ai, i)
+    ss._ann_conf = np.delete(ss._ann_conf, i)
+
+
+def _window_slice(x_min, x_max) -> slice:
+    """Index positions with x_min <= time <= x_max, via binary search on the sorted index."""
+    times = st.session_state._ann_times
+    return slice(np.searchsorted(times, x_min, side="left"), np.searchsorted(times, x_max, side="right"))
+
+
+def annotations_in_window(x_min, x_max):
+    """Annotations with x_min <= time <= x_max in time order."""
+    ss = st.session_state
+    return [ss.annotations[i] for i in ss._ann_ids[_window_slice(x_min, x_max)].tolist()]
+
+
+def annotation_columns_in_window(x_min, x_max):
+    """(times, type codes, aiGenerated flags) arrays for the annotations in [x_min, x_max]."""
+    ss = st.session_state
+    sl = _window_slice(x_min, x_max)
+    return ss._ann_times[sl], ss._ann_types[sl], ss._ann_ai[sl]
+
+
+def annotation_times(ann_type: str) -> np.ndarray:
+    """Sorted times of all annotations of one type, straight from the index (no dict scan)."""
+    ss = st.session_state
+    return ss._ann_times[ss._ann_types == ANNOTATION_CODES[ann_type]]
+
+
+def submit_for_review():
+    """Button callback: runs before the script, so the new status renders without an extra rerun."""
+    st.session_state.quality_status = "under-review"
+    st.session_state.review_submitted_at = time.monotonic()
+
+
+@st.fragment(run_every=1.0)
+def review_poll():
+    """Simulated reviewer: approves REVIEW_DELAY seconds after submission without blocking the script."""
+    if time.monotonic() - st.session_state.review_submitted_at >= REVIEW_DELAY:
+        st.session_state.quality_status = "approved"
+        st.rerun()
+    st.caption("Review in progress...")
+
+
+@st.cache_resource
+def _detection_pool():
+    """Worker threads shared by all sessions for Auto-Detect jobs."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="ai-detect")
+
+
+def start_detection():
+    """
+    Auto-Detect button callback: snapshot the inputs here (worker threads must not touch
+    session state) and run the detector in the background; `detection_poll` merges the result.
+    """
+    ss = st.session_state
+    ss.ai_future = _detection_pool().submit(
+        run_ai_detection_simulation, ss.ecg_sig, ss.selected_lead, annotation_times("R-Peak"), ss.rng)
+    ss.pop("ai_message", None)
+
+
+@st.fragment(run_every=DETECTION_POLL)
+def detection_poll():
+    """Merge a finished background detection into the annotations; reruns the app once it lands."""
+    future = st.session_state.ai_future
+    if future.done():
+        del st.session_state.ai_future
+        try:
+            ai_annotations = future.result()
+        except Exception as e:
+            st.session_state.ai_message = ("error", f"AI detection failed: {e}")
+        else:
+            add_annotations(ai_annotations)
+            st.session_state.ai_message = ("success", f"AI suggested {len(ai_annotations)} annotations.")
+        st.rerun()
+    st.caption("Running AI detection...")
 
 
 # --- Session State Initialization ---
-if "ecg_df" not in st.session_state:
-    st.session_state.ecg_df = generate_ecg_data()
+if "ecg_sig" not in st.session_state:
+    set_ecg_signal(generate_ecg_data())
+
+# Annotations keyed by id, plus parallel time-sorted arrays (times, ids, type codes, AI flags,
+# confidences) for queries and export.
+# Always mutate through add_annotations / remove_annotation so the two stay in sync.
+if "_id_counter" not in st.session_state:
+    st.session_state._id_counter = 0
 
 if "annotations" not in st.session_state:
-    st.session_state.annotations = []
+    st.session_state.annotations = {}
+    st.session_state._ann_times = np.empty(0, dtype=np.float64)
+    st.session_state._ann_ids = np.empty(0, dtype=np.int64)
+    st.session_state._ann_types = np.empty(0, dtype=np.uint8)
+    st.session_state._ann_ai = np.empty(0, dtype=bool)
+    st.session_state._ann_conf = np.empty(0, dtype=np.float64)
 
 if "uploaded_file_name" not in st.session_state:
     st.session_state.uploaded_file_name = ""
@@ -863,12 +618,23 @@ if "uploaded_file_name" not in st.session_state:
 if "extracted_leads" not in st.session_state:
     st.session_state.extracted_leads = {}
 
+if "extracted_image" not in st.session_state:
+    st.session_state.extracted_image = b""
+    st.session_state.extracted_digest = ""
+
 if "comments" not in st.session_state:
     st.session_state.comments = []
 
 if "quality_status" not in st.session_state:
     st.session_state.quality_status = "pending"
 
+if "annotation_mode" not in st.session_state:
+    st.session_state.annotation_mode = ANNOTATION_NAMES[0]
+
+# One Generator per session (simulated confidences); generate_ecg_data keeps its own seeded one
+if "rng" not in st.session_state:
+    st.session_state.rng = np.random.default_rng()
+
 # --- Layout ---
 st.set_page_config(page_title="ECG Annotation Platform", layout="wide", initial_sidebar_state="expanded")
 st.title("ECG Annotation Platform (Streamlit)")
@@ -876,35 +642,63 @@ st.title("ECG Annotation Platform (Streamlit)")
 # Sidebar: upload, lead selection, annotation type, controls
 with st.sidebar:
     st.header("Files & Controls")
-    uploaded_file = st.file_uploader("Upload ECG file (edf, dat, jpg, png, pdf)", type=['edf', 'dat', 'jpg', 'jpeg', 'png', 'pdf'])
+    uploaded_files = st.file_uploader("Upload ECG file (edf, dat + hea, jpg, png, pdf)",
+                                      type=['edf', 'dat', 'hea', 'jpg', 'jpeg', 'png', 'pdf'],
+                                      accept_multiple_files=True)
+    # A WFDB record is a .dat plus its .hea header; every other format is a single file
+    header_file = next((f for f in uploaded_files if f.name.lower().endswith('.hea')), None)
+    uploaded_file = next((f for f in uploaded_files if f is not header_file), None)
+    if header_file is not None and uploaded_file is None:
+        st.info(f"Header {header_file.name} received - upload the matching .dat file too.")
     if uploaded_file is not None:
         fname = uploaded_file.name
         st.session_state.uploaded_file_name = fname
         ext = fname.split('.')[-1].lower()
+        # Parse only when a different file arrives; later reruns reuse the session-state results
+        upload_id = (uploaded_file.file_id, header_file.file_id if header_file is not None else None)
+        new_upload = st.session_state.get("_upload_id") != upload_id
+        st.session_state._upload_id = upload_id
+        if new_upload:
+            # a new record is shown from its beginning
+            st.session_state.record_start = 0.0
 
         if ext in ['jpg', 'jpeg', 'png']:
-            img = Image.open(uploaded_file).convert("RGB")
-            st.session_state.extracted_leads = {}
-            st.info("Extracting leads from image (heuristic)...")
-            extracted = extract_leads_from_image_pil(img)
-            st.session_state.extracted_leads = extracted
-            # For demo, still use simulated ECG signals
-            st.session_state.ecg_df = generate_ecg_data()
-            st.success(f"Image {fname} loaded. {len(extracted)} lead images extracted (bytes stored).")
-        elif ext == 'edf':
-            buffer = uploaded_file.read()
-            df = parse_edf_file(buffer)
-            st.session_state.ecg_df = df
-            st.success(f"EDF file {fname} loaded. Samples: {len(df)}")
-        elif ext in ['dat', 'wfdb']:
-            buffer = uploaded_file.read()
-            df = parse_wfdb_dat(buffer)
-            st.session_state.ecg_df = df
-            st.success(f"WFDB-like file {fname} processed. Samples: {len(df)}")
+            if new_upload:
+                img_bytes = uploaded_file.getvalue()
+                st.session_state.extracted_leads = extract_leads_from_image_pil(img_bytes)
+                st.session_state.extracted_image = img_bytes
+                st.session_state.extracted_digest = buffer_digest(img_bytes)
+                # For demo, still use simulated ECG signals
+                set_ecg_signal(generate_ecg_data())
+            st.success(f"Image {fname} loaded. {len(st.session_state.extracted_leads)} lead regions located.")
+        elif ext in ['edf', 'dat', 'wfdb']:
+            # Records are read one MAX_VISIBLE_DURATION window at a time; re-read when the file or
+            # the window start changes (parses are cached per (bytes, start), so moving back is cheap)
+            start_sec = st.session_state.get("record_start", 0.0)
+            if new_upload or st.session_state.get("_loaded_start") != start_sec:
+                if ext == 'edf':
+                    parsed = parse_edf_file(uploaded_file.getvalue(), start_sec)
+                else:
+                    header_bytes = header_file.getvalue() if header_file is not None else b""
+                    parsed = parse_wfdb_dat(uploaded_file.getvalue(), header_bytes, start_sec)
+                st.session_state._record_loaded = parsed is not None
+                set_ecg_signal(parsed if parsed is not None else generate_ecg_data())
+                st.session_state._loaded_start = start_sec
+            sig = st.session_state.ecg_sig
+            kind = "EDF file" if ext == 'edf' else "WFDB record"
+            if not st.session_state._record_loaded:
+                st.warning(f"{kind} {fname} could not be read - showing simulated data.")
+            else:
+                st.success(f"{kind} {fname} loaded. {signal_summary(sig)}")
+                if sig["record_duration"] > MAX_VISIBLE_DURATION:
+                    st.number_input("Record window start (s)", min_value=0.0,
+                                    max_value=sig["record_duration"] - MAX_VISIBLE_DURATION,
+                                    step=MAX_VISIBLE_DURATION / 2, key="record_start")
         elif ext == 'pdf':
             # PDF handling is complex in-browser; show placeholder
             st.warning("PDF processing requires extra dependencies (pdf2image + poppler). For now loading simulated data.")
-            st.session_state.ecg_df = generate_ecg_data()
+            if new_upload:
+                set_ecg_signal(generate_ecg_data())
             st.success(f"PDF {fname} received (not fully processed).")
         else:
             st.error("Unsupported file format - using simulated ECG.")
@@ -912,183 +706,180 @@ with st.sidebar:
     st.markdown("---")
     selected_lead = st.selectbox("Select Lead", LEADS, index=1)
     st.session_state.selected_lead = selected_lead
-
-    ann_mode = st.selectbox("Annotation Type", [a["name"] for a in ANNOTATION_TYPES], index=0)
-    st.session_state.annotation_mode = ann_mode
+    lead_box = st.session_state.extracted_leads.get(selected_lead)
+    if lead_box is not None:
+        st.image(encode_lead_png(st.session_state.extracted_digest, lead_box,
+                                 st.session_state.extracted_image), caption=f"{selected_lead} (from image)")
 
     st.markdown("### View")
     show_grid = st.checkbox("Show Grid", value=True)
-    zoom = st.slider("Zoom (x)", min_value=0.5, max_value=4.0, value=1.0, step=0.5)
+    zoom = st.slider("Zoom (x)", min_value=ZOOM_MIN, max_value=ZOOM_MAX, value=1.0, step=0.5)
     st.session_state.show_grid = show_grid
     st.session_state.zoom = zoom
 
     st.markdown("### AI Assistance")
-    if st.button("Auto-Detect (AI)"):
-        with st.spinner("Running AI detection (simulated)..."):
-            ai_annotations = run_ai_detection_simulation(st.session_state.ecg_df, selected_lead, st.session_state.annotations)
-            # append using session_state
-            st.session_state.annotations = st.session_state.annotations + ai_annotations
-            st.success(f"AI suggested {len(ai_annotations)} annotations.")
+    detecting = "ai_future" in st.session_state
+    st.button("Auto-Detect (AI)", disabled=detecting, on_click=start_detection)
+    # detection runs on a worker thread; poll from a timed fragment so the UI stays responsive
+    if detecting:
+        detection_poll()
+    elif "ai_message" in st.session_state:
+        kind, msg = st.session_state.ai_message
+        (st.success if kind == "success" else st.error)(msg)
 
     st.markdown("---")
     st.markdown("### Quality Control")
     st.write(f"Status: **{st.session_state.quality_status}**")
-    if st.button("Submit for Review", disabled=(st.session_state.quality_status != "pending")):
-        st.session_state.quality_status = "under-review"
-        st.experimental_rerun()  # quick feedback; reviewed will be set below
+    st.button("Submit for Review", disabled=(st.session_state.quality_status != "pending"), on_click=submit_for_review)
 
-    # approve simulation
+    # approve simulation: poll from a timed fragment instead of sleeping in the script
     if st.session_state.quality_status == "under-review":
-        # immediately approve after a small delay (simulate)
-        time.sleep(1.0)
-        st.session_state.quality_status = "approved"
-        st.experimental_rerun()
+        review_poll()
 
     st.markdown("---")
     if st.button("Export Annotations (.json)"):
         export = {
             "metadata": {
+                **EXPORT_METADATA,
                 "fileName": st.session_state.uploaded_file_name or "simulated-ecg",
-                "lead": st.session_state.selected_lead if "selected_lead" in st.session_state else selected_lead,
+                "lead": selected_lead,
                 "exportDate": datetime.utcnow().isoformat() + "Z",
-                "annotator": "Streamlit User",
             },
+            # rows zipped straight from the time-ordered index columns; no per-annotation dict access
             "annotations": [
-                {
-                    "time": float(a["time"]),
-                    "type": a["type"],
-                    "aiGenerated": bool(a.get("aiGenerated", False)),
-                    "confidence": float(a.get("confidence", 0.0))
-                } for a in st.session_state.annotations
+                {"time": t, "type": ann_type, "aiGenerated": ai, "confidence": conf}
+                for t, ann_type, ai, conf in zip(
+                    st.session_state._ann_times.tolist(),
+                    ANNOTATION_NAME_BY_CODE[st.session_state._ann_types].tolist(),
+                    st.session_state._ann_ai.tolist(),
+                    st.session_state._ann_conf.tolist(),
+                )
             ]
         }
-        b = json.dumps(export, indent=2).encode("utf-8")
+        b = dumps_json(export)
         st.download_button("Download JSON", b, file_name="ecg-annotations.json", mime="application/json")
 
 
 # Main: ECG viewer and annotation list
-col1, col2 = st.columns([3, 1])
-
-with col1:
+def add_clicked_annotation():
+    """Chart selection callback: add an annotation of the current type at the clicked time."""
+    points = st.session_state.ecg_chart.selection.points
+    if points:
+        add_annotations([{
+            "time": float(points[0]["x"]),
+            "type": st.session_state.annotation_mode,
+            "lead": st.session_state.selected_lead,
+            "aiGenerated": False,
+            "user": "Current User"
+        }])
+
+
+def ecg_viewer():
+    """Waveform viewer; a click on the chart adds an annotation of the current type."""
     st.subheader(f"Viewer — {st.session_state.uploaded_file_name or 'Simulated ECG'} — {st.session_state.selected_lead}")
-    df = st.session_state.ecg_df.copy()
+    sig = st.session_state.ecg_sig
+    v_arr = sig["v"]
     # apply zoom by taking portion of data; zoom>1 means shorter visible duration
     visible_duration = DURATION_DEFAULT / st.session_state.zoom
-    # center view around 0..visible_duration by default
-    x_min = 0.0
-    x_max = visible_duration
+    # view starts at the first loaded sample (the record window start for long records)
+    x_min = sig["t0"]
+    x_max = x_min + visible_duration
 
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        x=df['time'],
-        y=df['value'],
-        mode='lines',
-        line=dict(color='#22c55e'),
-        name='ECG'
-    ))
+    # Copy the cached waveform figure; the cached instance is shared and must not be mutated.
+    # The figure holds a downsampled trace; annotation math below uses the full-resolution signal
+    fig = go.Figure(build_base_figure(st.session_state.ecg_key, x_min, x_max,
+                                      st.session_state.show_grid, sig))
 
     # Add annotation shapes (vertical lines) and markers
-    shapes = []
-    ann_markers_x = []
-    ann_markers_y = []
-    ann_texts = []
-    for ann in st.session_state.annotations:
-        if x_min <= ann["time"] <= x_max:
-            shapes.append(dict(
-                type="line",
-                x0=ann["time"],
-                x1=ann["time"],
-                y0=df['value'].min() - 0.5,
-                y1=df['value'].max() + 0.5,
-                line=dict(color='#a855f7' if ann.get("aiGenerated") else "#FF9900", width=2, dash="dash" if not ann.get("aiGenerated") else "dot")
-            ))
-            ann_markers_x.append(ann["time"])
-            # find y at that time (closest)
-            closest_idx = int((np.abs(df['time'] - ann["time"])).idxmin())
-            ann_markers_y.append(df['value'].iloc[closest_idx])
-            ann_texts.append(ann.get("type", "") + (" (AI)" if ann.get("aiGenerated") else ""))
-
-    if ann_markers_x:
+    y_low, y_high = st.session_state.ann_line_y
+    times, codes, ai = annotation_columns_in_window(x_min, x_max)
+    # one WebGL trace per line style instead of one SVG layout shape per annotation
+    for is_ai, color, dash in ANNOTATION_LINE_STYLES:
+        style_t = times[ai == is_ai]
+        if style_t.size:
+            fig.add_trace(vline_trace(style_t, y_low, y_high, color, dash))
+
+    if times.size:
+        # labels, colours and y (nearest sample) all gathered from the index columns
+        texts = np.char.add(ANNOTATION_NAME_BY_CODE[codes], np.where(ai, " (AI)", "")).tolist()
+        # labels collide when zoomed in or crowded; then send markers only and show labels on hover
+        show_labels = st.session_state.zoom <= 2 and times.size <= MARKER_LABELS_MAX
         fig.add_trace(go.Scatter(
-            x=ann_markers_x,
-            y=ann_markers_y,
-            mode='markers+text',
-            marker=dict(size=8, color='red'),
-            text=ann_texts,
+            x=times,
+            y=v_arr[sample_index(sig, times)],
+            mode='markers+text' if show_labels else 'markers',
+            marker=dict(size=8, color=ANNOTATION_COLOR_BY_CODE[codes].tolist()),
+            text=texts,
             textposition="top center",
+            hovertemplate="%{text}<extra></extra>",
             showlegend=False
         ))
 
-    fig.update_layout(
-        shapes=shapes,
-        margin=dict(l=40, r=20, t=20, b=40),
-        template="plotly_dark",
-        xaxis=dict(range=[x_min, x_max], title="Time (s)"),
-        yaxis=dict(title="Amplitude (mV)"),
-        height=450
-    )
+    # Native chart selection: a click selects the nearest point and fires `add_clicked_annotation`
+    # before this fragment reruns, so the new marker is drawn in that same rerun
+    st.plotly_chart(fig, key="ecg_chart", on_select=add_clicked_annotation, selection_mode=("points",))
 
-    # Render interactive Plotly chart and capture clicks with plotly_events
-    # plotly_events returns list of dicts for clicked points (x,y)
-    ev = plotly_events(fig, click_event=True, hover_event=True, select_event=False, override_height=450)
-
-    # When user clicks on canvas (point), add annotation at clicked x
-    if ev:
-        # Plotly click event produces list; handle first
-        e0 = ev[0]
-        if 'x' in e0:
-            clicked_x = float(e0['x'])
-            # Add annotation at clicked time
-            new_ann = {
-                "id": int(time.time() * 1000),
-                "time": clicked_x,
-                "type": st.session_state.annotation_mode,
-                "lead": st.session_state.selected_lead,
-                "aiGenerated": False,
-                "user": "Current User"
-            }
-            st.session_state.annotations.append(new_ann)
-            st.experimental_rerun()
-
-with col2:
+
+def annotation_list():
+    """Annotation type picker plus the time-ordered annotation list with per-row removal."""
     st.subheader("Annotations")
+    # keyed widget inside the fragment: changing the type reruns only the workspace
+    st.selectbox("Annotation Type", ANNOTATION_NAMES, key="annotation_mode")
     if len(st.session_state.annotations) == 0:
         st.info("No annotations yet. Click on the waveform to add one, or use Auto-Detect.")
     else:
-        for ann in sorted(st.session_state.annotations, key=lambda a: a["time"]):
+        for ann in annotations_in_window(-np.inf, np.inf):
             row = st.container()
             with row:
                 cols = st.columns([0.15, 0.6, 0.25])
-                ann_symbol = next((a["symbol"] for a in ANNOTATION_TYPES if a["name"] == ann["type"]), "?")
+                ann_symbol = ANNOTATION_SYMBOLS.get(ann["type"], "?")
                 cols[0].markdown(f"**{ann_symbol}**")
-                cols[1].markdown(f"{ann['type']}  \n**{ann['time']:.3f}s**{'  \n**(AI)**' if ann.get('aiGenerated') else ''}")
-                if cols[2].button("Remove", key=f"rm_{ann['id']}"):
-                    st.session_state.annotations = [a for a in st.session_state.annotations if a["id"] != ann["id"]]
-                    st.experimental_rerun()
+                ai_tag = "  \n**(AI)**" if ann.get("aiGenerated") else ""
+                cols[1].markdown(f"{ann['type']}  \n**{ann['time']:.3f}s**{ai_tag}")
+                cols[2].button("Remove", key=f"rm_{ann['id']}", on_click=remove_annotation, args=(ann["id"],))
+
+
+@st.fragment
+def annotation_workspace():
+    """
+    Viewer and annotation list share one fragment: chart clicks, Remove buttons and the
+    annotation type picker rerun only this block (both columns stay in sync) instead of
+    the whole script.
+    """
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        ecg_viewer()
+    with col2:
+        annotation_list()
+
+
+annotation_workspace()
 
 st.markdown("---")
 # Comments panel
 st.subheader("Comments")
-c1, c2 = st.columns([4, 1])
-with c1:
-    comment_text = st.text_area("Add comment", key="comment_box", height=80)
-with c2:
-    if st.button("Post"):
-        if comment_text and comment_text.strip():
-            st.session_state.comments.append({
-                "id": int(time.time() * 1000),
-                "user": "Current User",
-                "text": comment_text.strip(),
-                "timestamp": datetime.utcnow().isoformat() + "Z"
-            })
-            st.session_state.comment_box = ""
-            st.experimental_rerun()
+# A form defers the rerun to Post, so typing doesn't re-execute the script on every keystroke
+with st.form("comment_form", clear_on_submit=True, border=False):
+    c1, c2 = st.columns([4, 1])
+    with c1:
+        comment_text = st.text_area("Add comment", height=80)
+    with c2:
+        submitted = st.form_submit_button("Post")
+if submitted and comment_text and comment_text.strip():
+    st.session_state.comments.append({
+        "id": next_id(),
+        "user": "Current User",
+        "text": comment_text.strip(),
+        "timestamp": datetime.utcnow().isoformat() + "Z"
+    })
 
 if st.session_state.comments:
-    for c in reversed(st.session_state.comments[-50:]):
-        st.markdown(f"**{c['user']}** • {c['timestamp']}")
-        st.write(c["text"])
-        st.markdown("---")
+    # newest COMMENTS_SHOWN comments; each is its own markdown element so one comment's block
+    # markdown (an unclosed code fence, a heading) can't spill into the ones after it
+    with st.container():
+        for c in itertools.islice(reversed(st.session_state.comments), COMMENTS_SHOWN):
+            st.markdown(f"**{c['user']}** • {c['timestamp']}\n\n{c['text']}")
+            st.divider()
 
 # Small status & instructions
 st.sidebar.markdown("### App Status")